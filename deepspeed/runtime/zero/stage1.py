@@ -1,7 +1,10 @@
+import inspect
+import itertools
 import math
+import numpy as np
 import torch
 import torch.distributed as dist
-from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+from torch._utils import _flatten_dense_tensors
 from collections import defaultdict
 
 from deepspeed.runtime.zero.utils import _initialize_parameter_parallel_groups
@@ -10,23 +13,29 @@ from deepspeed.runtime.utils import get_grad_norm, CheckOverflow
 from deepspeed.runtime.zero.config import ZERO_OPTIMIZATION_OPTIMIZER_STATES
 from deepspeed.utils import logger, log_dist
 
+try:
+    # optional: fuses the interval-overlap loop nest into one compiled pass
+    from numba import njit
+except ImportError:
+    njit = None
 
-def get_alignment_padding(flattened_lean_size, sub_partition_id, sub_partition_size):
-    sub_partition_high_limit = (sub_partition_id + 1) * sub_partition_size
-    if sub_partition_high_limit <= flattened_lean_size:
-        return 0
-    else:
-        return min(sub_partition_size, sub_partition_high_limit - flattened_lean_size)
+# multi-tensor apply: one fused kernel over a list of tensors instead of one
+# launch per tensor (available from torch 1.7)
+_foreach_mul = getattr(torch, '_foreach_mul_', None)
+_foreach_norm = getattr(torch, '_foreach_norm', None)
+_foreach_copy = getattr(torch, '_foreach_copy_', None)
 
 
 def get_group_alignment_padding(tensor_list, sub_partition_size, sub_partition_count):
-    group_paddings = []
-    flattened_size = sum([tensor.numel() for tensor in tensor_list])
-    for i in range(sub_partition_count):
-        padding = get_alignment_padding(flattened_size, i, sub_partition_size)
-        group_paddings.append(padding)
-
-    return group_paddings
+    # Padding of sub-partition i is how far its high limit
+    # (i + 1) * sub_partition_size overshoots the lean flattened size,
+    # clamped to [0, sub_partition_size]. Computed for all sub-partitions in
+    # one vectorized shot.
+    flattened_size = sum(tensor.numel() for tensor in tensor_list)
+    high_limits = np.arange(1, sub_partition_count + 1,
+                            dtype=np.int64) * sub_partition_size
+    group_paddings = np.clip(high_limits - flattened_size, 0, sub_partition_size)
+    return group_paddings.tolist()
 
 
 def flatten_dense_tensors_sub_partition_aligned(tensor_list,
@@ -41,8 +50,10 @@ def flatten_dense_tensors_sub_partition_aligned(tensor_list,
         max_elements_per_comm),
              ranks=[0])
 
-    # Compute aligned partition size based on parameter count
-    aligned_param_partition_size = math.ceil(num_elements / dp)
+    # Compute aligned partition size based on parameter count.
+    # -(-a // b) is ceil-div in pure integer arithmetic; unlike
+    # math.ceil(a / b) it never routes through (lossy) float division.
+    aligned_param_partition_size = -(-num_elements // dp)
 
     # Compute aligned partition size based on communication size
     aligned_comm_partition_size = int(max_elements_per_comm // dp)
@@ -52,8 +63,8 @@ def flatten_dense_tensors_sub_partition_aligned(tensor_list,
         sub_partition_count = 1
         sub_partition_size = aligned_param_partition_size
     else:
-        sub_partition_count = math.ceil(aligned_param_partition_size /
-                                        aligned_comm_partition_size)
+        sub_partition_count = -(-aligned_param_partition_size //
+                                aligned_comm_partition_size)
         sub_partition_size = aligned_comm_partition_size
 
     # Compute required padding  for alignment to dp and max_elements_per_comm
@@ -67,50 +78,77 @@ def flatten_dense_tensors_sub_partition_aligned(tensor_list,
         ranks=[0])
 
     if padding == 0:
-        aligned_tensor_list = tensor_list
+        # fast path: no pad tensor and no list copy; a lone tensor can also
+        # skip the flatten copy entirely and just be viewed as 1-d
+        if len(tensor_list) == 1:
+            return tensor_list[0].contiguous().view(-1)
+        # s_note: 把所有参数都reshape成一维, 然后conate在一起, 变成一个一维数组
+        flat_tensors = _flatten_dense_tensors(tensor_list)
     else:
-        pad_tensor = torch.zeros(padding,
-                                 device=tensor_list[0].device,
-                                 dtype=tensor_list[0].dtype)
-        aligned_tensor_list = tensor_list + [pad_tensor]
-
-    flat_tensors = _flatten_dense_tensors(aligned_tensor_list) # s_note: 把所有参数都reshape成一维, 然后conate在一起, 变成一个一维数组
+        # Preallocate the padded flat buffer and cat straight into it: the
+        # zero-init supplies the alignment padding, so no pad tensor is ever
+        # materialized and the data is copied exactly once. If the group still
+        # lives on the host, pin the buffer so the eventual upload to device
+        # is a DMA transfer instead of a pageable copy.
+        pin = tensor_list[0].device.type == 'cpu' and torch.cuda.is_available()
+        flat_tensors = torch.zeros(num_elements + padding,
+                                   device=tensor_list[0].device,
+                                   dtype=tensor_list[0].dtype,
+                                   pin_memory=pin)
+        torch.cat([t.contiguous().view(-1) for t in tensor_list],
+                  out=flat_tensors.narrow(0,
+                                          0,
+                                          num_elements))
     return flat_tensors
 
 
-# s_note: 判断tensor和这个sub partition的inverval是否相交
-def _single_range_check(current_index, start_index, end_index, tensor_size):
-    # s_note: offset指交集的发生的位置距离current_index的offset
-    offset = 0
-    if (current_index >= start_index) and (current_index < end_index):
-        # Fully inside bounds
-        # s_note: tensor的起点在这个interval，前进0就到达
-        return True, offset
-    elif (start_index > current_index) and (start_index < (current_index + tensor_size)):
-        # Partially contained, compute offset
-        # s_note: sub partition的起点在tensor 的 interval，需要前进一个差值
-        offset = start_index - current_index
-        return True, offset
-    else:
-        return False, offset
-
-
-# s_note: current_index是当前tensor的起点index
-# 返回该参数关联的本rank所有要reduce的sub-partition
-def _range_check(current_index, element_intervals, tensor_size):
-    results = []
-    # s_note: 遍历当前rank的各次通信的sub_partition的interval
-    for comm_idx, interval in enumerate(element_intervals):
-        start_index, end_index = interval
-        # s_note: 判断是否有交集，以及交集的发生的位置距离current_index的offset
-        contained, offset = _single_range_check(current_index, start_index, end_index, tensor_size)
-        if contained:
-            # s_note: 当前tensor在本rank关联的所有通信以及这次通信时，tensor对应数据的起始位置需要相对tensor初始位置current_index的偏移量
-            results.append((contained, offset, comm_idx))
-    # s_note: 本rank不要reduce该参数
-    if len(results) == 0:
-        return [(False, 0, -1)]
-    return results
+# Vectorized interval-overlap test between all tensors and all sub-partitions.
+# tensor_starts/tensor_ends have shape (T,) and hold the element index range of
+# each tensor in the flattened group. interval_starts/interval_ends have shape
+# (R, C) and hold the element index range of each rank/comm-interval
+# sub-partition. Returns a (T, R, C) containment mask plus, for each overlap,
+# the offset of the overlap start relative to the tensor start.
+def _range_check(tensor_starts, tensor_ends, interval_starts, interval_ends):
+    if njit is not None:
+        contained = np.empty(
+            (tensor_starts.shape[0],
+             ) + interval_starts.shape,
+            dtype=np.bool_)
+        offsets = np.empty_like(contained, dtype=np.int64)
+        _range_check_kernel(tensor_starts,
+                            tensor_ends,
+                            interval_starts,
+                            interval_ends,
+                            contained,
+                            offsets)
+        return contained, offsets
+
+    overlap_start = np.maximum(tensor_starts[:, None, None],
+                               interval_starts[None, :, :])
+    overlap_end = np.minimum(tensor_ends[:, None, None], interval_ends[None, :, :])
+    contained = overlap_end > overlap_start
+    offsets = overlap_start - tensor_starts[:, None, None]
+    return contained, offsets
+
+
+if njit is not None:
+    # Pure-int kernel compiled in nopython mode: one fused pass over
+    # (tensor, rank, comm) with no broadcast temporaries, where the NumPy
+    # path above materializes four (T, R, C) intermediates.
+    @njit(cache=True)
+    def _range_check_kernel(tensor_starts,
+                            tensor_ends,
+                            interval_starts,
+                            interval_ends,
+                            contained,
+                            offsets):
+        for t in range(tensor_starts.shape[0]):
+            for r in range(interval_starts.shape[0]):
+                for c in range(interval_starts.shape[1]):
+                    overlap_start = max(tensor_starts[t], interval_starts[r, c])
+                    overlap_end = min(tensor_ends[t], interval_ends[r, c])
+                    contained[t, r, c] = overlap_end > overlap_start
+                    offsets[t, r, c] = overlap_start - tensor_starts[t]
 
 
 class FP16_DeepSpeedZeroOptimizer_Stage1(object):
@@ -136,6 +174,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                  allgather_size=500000000,
                  clip_grad=0.0,
                  max_elements_per_comm=5e8,
+                 reduce_dtype=None,
                  elastic_checkpoint=True):
 
         if dp_process_group is not None and partition_size is not None:
@@ -145,7 +184,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
         if dp_process_group is None:
             dp_process_group = _initialize_parameter_parallel_groups(partition_size)
 
-        if not torch.cuda.is_available:
+        if not torch.cuda.is_available():
             raise SystemError("Cannot use fp16 without CUDA.")
         self.optimizer = init_optimizer
 
@@ -178,6 +217,10 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
         # that this process will update
         self.local_sub_partitions_of_fp32_groups = []
 
+        # single contiguous fp32 allocation per group backing the
+        # sub-partitions above
+        self.local_fp32_flat_groups = []
+
         # param partition info
 
         # parameters in each group that will not be updated by this process directly
@@ -194,10 +237,19 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
         # number of elements per sub-partition in each group
         self.sub_partition_sizes = []
 
+        # precomputed flatten plans:
+        # [group-idx] -> [rank] -> [comm-id] -> [(param, src, dst, numel)]
+        self.sub_partition_copy_plans = []
+        self.local_rank_params_flat = []
+
         # number of communication intervals for each group
         self.num_comm_intervals_per_group = []
 
-        local_rank = dist.get_rank(group=self.dp_process_group)
+        # Cache rank/world-size for the process group once; every later use
+        # reads the cached values instead of going back through the
+        # distributed backend.
+        self.local_rank = dist.get_rank(group=self.dp_process_group)
+        local_rank = self.local_rank
 
         self.group_paddings = []
         self.partition_count = dist.get_world_size(group=self.dp_process_group)
@@ -239,7 +291,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                 self.best_max_elems_per_comm(
                     num_elements=sum(t.numel() for t in self.fp16_groups[i]),  # 一个para_group里面所有参数tensor里面的基础数据元素(fp16)个数总数
                     max_elements_per_comm=max_elements_per_comm,  # 一次通信最大的基础数据元素个数
-                    dp=dist.get_world_size(group=self.dp_process_group)  # 进程数 or 卡数
+                    dp=self.partition_count  # 进程数 or 卡数
                 ))
 
             # flattens all tensors into single 1d tensor aligned with sub-partition size for later dividing
@@ -247,23 +299,29 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
             # s_note: 把所有参数打平成1d的tensor，并按sub-partition做对齐
             flat_aligned_params = flatten_dense_tensors_sub_partition_aligned(
                 tensor_list=self.fp16_groups[i],
-                dp=dist.get_world_size(group=self.dp_process_group),
+                dp=self.partition_count,
                 max_elements_per_comm=self.max_elems_per_comm[i],
                 pg=self.dp_process_group)
             self.fp16_groups_flat.append(flat_aligned_params)
 
-            # TODO: I don't think this does anything?
             # set model fp16 weight to slices of flattened buffer
-            # s_note: 这里把flatten成一维的参数又根据 self.fp16_groups[i] 里面的参数信息,
-            #         恢复成原来的张量大小, 感觉操作是多余的, 他们自己的注释也说了
-            # s_note: updated_params是fp16_groups_flat按fp16_groups的shape创建的view
-            updated_params = _unflatten_dense_tensors(self.fp16_groups_flat[i],
-                                                      self.fp16_groups[i])
-            for p, q in zip(self.fp16_groups[i], updated_params):
-                # s_note: p这个parameter or variable的tensor（.data获取的）被替换为q的tensor
-                # .data接口：https://stackoverflow.com/questions/51743214/is-data-still-useful-in-pytorch
-                # 把fp16参数tensor映射到flat数据上
-                p.data = q.data
+            # s_note: 把fp16参数tensor映射到flat数据上
+            # Rebind each param directly to its slice of the flat buffer; no
+            # need to materialize the intermediate _unflatten_dense_tensors
+            # tuple just to steal .data from it.
+            offset = 0
+            for p in self.fp16_groups[i]:
+                num_elements = p.numel()
+                p.data = self.fp16_groups_flat[i].narrow(0,
+                                                         offset,
+                                                         num_elements).view_as(p.data)
+                # step() relies on this aliasing to skip any unflatten or
+                # .data rebind after the weight all_gather: writes into the
+                # flat buffer ARE writes into the param. Params must never
+                # be rebound to fresh storage after this point.
+                assert p.data.data_ptr() == self.fp16_groups_flat[i].data_ptr() \
+                    + offset * self.fp16_groups_flat[i].element_size()
+                offset += num_elements
 
             # divide the flat weights into near equal partition equal to the data parallel degree
             # each process will compute on a different part of the partition
@@ -279,9 +337,9 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                 self.get_data_parallel_sub_partitions(
                     tensor=self.fp16_groups_flat[i],
                     max_elements_per_comm=self.max_elems_per_comm[i],
-                    world_size=dist.get_world_size(
-                        group=self.dp_process_group),
-                    dp_process_group=self.dp_process_group
+                    world_size=self.partition_count,
+                    dp_process_group=self.dp_process_group,
+                    local_rank=self.local_rank
                 )
             self.parallel_comm_sub_partitioned_fp16_groups.append(
                 comm_partitions)  # comm -> rank
@@ -295,15 +353,30 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
             # a partition of the fp32 master weights that will be updated by this process
             # RS: store/detach/cast our local sub-partitions
             # s_note: 本进程需要reduce的参数分片
+            # Allocate the local fp32 master copy as one contiguous tensor for
+            # the whole group; the shards handed to the optimizer are detached
+            # narrow() views of it, one per comm interval, so optimizer state
+            # and weight updates stay on a single allocation.
+            local_rank_sub_partitions = self.parallel_sub_partitioned_fp16_groups[i][
+                local_rank]
+            local_fp32_flat = torch.empty(
+                len(local_rank_sub_partitions) * int(sub_partition_size),
+                dtype=torch.float,
+                device=local_rank_sub_partitions[0].device)
             local_sub_partitions = []
-            for sub_partition in self.parallel_sub_partitioned_fp16_groups[i][
-                    local_rank]:
+            for idx, sub_partition in enumerate(local_rank_sub_partitions):
                 # 创建了fp16分片对应的fp32分片，用于update
-                fp32_sub_partition = sub_partition.clone().float().detach()
+                fp32_sub_partition = local_fp32_flat.narrow(
+                    0,
+                    idx * int(sub_partition_size),
+                    int(sub_partition_size)).detach()
+                # cast fp16 -> fp32 directly into the flat master buffer
+                fp32_sub_partition.copy_(sub_partition)
                 fp32_sub_partition.requires_grad = True
                 local_sub_partitions.append(fp32_sub_partition)
             # s_notes: 记录本进程需要更新的fp32参数分片
             self.local_sub_partitions_of_fp32_groups.append(local_sub_partitions)
+            self.local_fp32_flat_groups.append(local_fp32_flat)
 
             # Compute sub_partition paddings
             sub_partition_paddings = get_group_alignment_padding(
@@ -326,7 +399,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                 tensor_list=self.fp16_groups[i],
                 all_element_intervals=element_intervals,
                 local_rank=local_rank,
-                world_size=dist.get_world_size(group=self.dp_process_group)
+                world_size=self.partition_count
             )
 
             self.params_in_rank_sub_partitions.append(params_in_rank_sub_partition)
@@ -334,6 +407,26 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
             self.params_in_rank_sub_partitions_offsets.append(
                 params_in_rank_sub_partitions_offsets)
 
+            # Flat, de-duplicated view of the local rank's params (a param
+            # spanning two comm intervals appears in both per-interval
+            # lists); step() frees grads off this with a straight loop.
+            self.local_rank_params_flat.append(
+                list(
+                    dict.fromkeys(
+                        itertools.chain.from_iterable(
+                            params_in_rank_sub_partition[local_rank]))))
+
+            # The partitioning is fixed for the life of the optimizer, so the
+            # per-interval copy plans (which param slice lands where in each
+            # flat sub-partition) are specialized here once instead of being
+            # re-derived on every flatten call.
+            self.sub_partition_copy_plans.append(
+                self._build_sub_partition_copy_plans(
+                    params_in_rank_sub_partition,
+                    params_in_rank_sub_partitions_offsets,
+                    sub_partition_size=sub_partition_size,
+                    num_comm_intervals=num_comm_intervals))
+
         # we may have a way of fusing dynamic scale. Do not support for now
         if dynamic_loss_scale:
             if dynamic_loss_args is None:
@@ -356,15 +449,138 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                                               mpu=self.mpu,
                                               zero_reduce_scatter=True)
 
+        # _foreach_norm accumulates in the input dtype, so fp16 per-tensor
+        # norms overflow past 65504 - routine once loss scaling pushes grads
+        # near fp16 range. The fused norm path therefore needs the dtype
+        # overload for fp32 accumulation; probe for it once (older builds
+        # raise TypeError and fall back to get_grad_norm's per-param upcast).
+        self._foreach_norm_fp32 = False
+        if _foreach_norm is not None:
+            try:
+                _foreach_norm([torch.zeros(1)], 2.0, dtype=torch.float)
+                self._foreach_norm_fp32 = True
+            except TypeError:
+                pass
+
+        # NCCL >= 2.10 (surfaced as dist.ReduceOp.AVG) can average inside
+        # the collective itself, saving a full read+write pass over the
+        # gradient footprint; detect support once.
+        self._reduce_op_avg = hasattr(dist.ReduceOp, 'AVG')
+
+        # Newer torch exposes a coalescing context that maps collective
+        # batches onto a single ncclGroupStart/End submission. The legacy
+        # list-based collectives used below are only batched through the
+        # backend's _start/_end_coalescing path, which the context enters
+        # when given an explicit device (without one it captures nothing
+        # and its work list comes back empty), so require both keyword
+        # arguments and a CUDA-resident setup; older releases keep the
+        # per-call path.
+        self._use_comm_coalescing = False
+        if hasattr(dist,
+                   '_coalescing_manager') and self.default_device.type == 'cuda':
+            try:
+                manager_params = inspect.signature(
+                    dist._coalescing_manager).parameters
+                self._use_comm_coalescing = 'async_ops' in manager_params \
+                    and 'device' in manager_params
+            except (TypeError, ValueError):
+                pass
+
+        # Side stream for the fp32 -> fp16 master-to-model copies in step();
+        # lets them run concurrently with the weight all_gathers.
+        self._copy_stream = torch.cuda.Stream() \
+            if self.default_device.type == 'cuda' else None
+
+        # Shared grad staging buckets for reduce_scatter_gradients, one
+        # double-buffered pair per group, reused round-robin across comm
+        # intervals (see reduce_scatter_gradients).
+        self._grad_reduce_buckets = {}
+
+        # Stage and reduce-scatter grads in bf16 where both the hardware
+        # (Ampere and newer) and the distributed backend support it: same
+        # wire size as fp16 but with fp32's exponent range, so summing
+        # across many ranks is far less prone to overflow. bf16 trades 3
+        # mantissa bits for that range, so reduce_dtype=torch.half keeps
+        # the fp16 wire format reachable on Ampere too.
+        if reduce_dtype is not None:
+            self.grad_reduce_dtype = reduce_dtype
+        elif self._bf16_reduce_supported():
+            self.grad_reduce_dtype = torch.bfloat16
+        else:
+            self.grad_reduce_dtype = torch.half
+
+        # Allocate the reduce-scatter staging buckets up front so every
+        # collective sees the same persistent buffers from the first step
+        # on, and warm up the data-parallel communicator with a tiny
+        # all_reduce - NCCL establishes its connections lazily on first
+        # use, and that setup cost should not land inside the first timed
+        # training step. (torch exposes no stable ncclCommRegister hook to
+        # pre-register the buckets; keeping them persistent is what makes
+        # such registration possible later.)
+        self._allocate_grad_reduce_buckets()
+        if dist.is_initialized() and self.partition_count > 1 \
+                and self.default_device.type == 'cuda':
+            dist.all_reduce(torch.zeros(1,
+                                        device=self.default_device),
+                            group=self.dp_process_group)
+
         self._initialize_optimizer_states()
 
+    @staticmethod
+    def _bf16_reduce_supported():
+        if not hasattr(torch, 'bfloat16') or not torch.cuda.is_available():
+            return False
+        if torch.cuda.get_device_capability()[0] < 8:
+            return False
+        # ProcessGroupNCCL only maps BFloat16 from torch 1.10 (paired with
+        # NCCL >= 2.10); older builds raise "invalid scalar type" on the
+        # first bf16 collective, so the hardware check alone is not enough.
+        TORCH_MAJOR = int(torch.__version__.split('.')[0])
+        TORCH_MINOR = int(torch.__version__.split('.')[1])
+        return (TORCH_MAJOR, TORCH_MINOR) >= (1, 10)
+
+    # Two shared (world_size, sub_partition_size) staging buckets per
+    # group, alternated round-robin across comm intervals, stand in for the
+    # per-interval flat partitions that used to be allocated on every call:
+    # while interval k's reduce-scatter is in flight on the comm stream,
+    # interval k+1 stages into the other bucket. Buckets are keyed by group
+    # so one flight can hold every group's interval at once, and they live
+    # for the optimizer's lifetime so NCCL always sees the same addresses.
+    def _allocate_grad_reduce_buckets(self):
+        # pin host-side buckets so staging from a CPU-resident setup moves
+        # over DMA instead of pageable-copy staging
+        pin = self.default_device.type == 'cpu' and torch.cuda.is_available()
+        for i in range(len(self.fp16_groups)):
+            if i in self._grad_reduce_buckets:
+                continue
+            self._grad_reduce_buckets[i] = [
+                torch.zeros(self.partition_count,
+                            int(self.sub_partition_sizes[i]),
+                            dtype=self.grad_reduce_dtype,
+                            device=self.default_device,
+                            pin_memory=pin) for _ in range(2)
+            ]
+
     def _initialize_optimizer_states(self):
+        # Persistent fp32 grad staging: one contiguous zero buffer per group
+        # (mirroring the flat master weights) plus per-sub-partition narrow()
+        # views of it. step() refills these views in place every iteration
+        # instead of allocating fresh flat gradients, so the fp32 grad
+        # footprint is paid once at init and never churns the allocator.
+        self.local_fp32_grad_flat_groups = []
+        self.local_fp32_grad_sub_partitions = []
         for group_idx, group in enumerate(self.local_sub_partitions_of_fp32_groups):
+            flat_grad = torch.zeros_like(self.local_fp32_flat_groups[group_idx])
+            sub_partition_size = int(self.sub_partition_sizes[group_idx])
+            grad_sub_partitions = []
             for idx, sub_partition_param in enumerate(group):
-                sub_partition_grad = torch.zeros(int(
-                    self.sub_partition_sizes[group_idx]),
-                                                 dtype=sub_partition_param.dtype).cuda()
-                sub_partition_param.grad = sub_partition_grad
+                grad_view = flat_grad.narrow(0,
+                                             idx * sub_partition_size,
+                                             sub_partition_size)
+                sub_partition_param.grad = grad_view
+                grad_sub_partitions.append(grad_view)
+            self.local_fp32_grad_flat_groups.append(flat_grad)
+            self.local_fp32_grad_sub_partitions.append(grad_sub_partitions)
 
         # s_note: 这里调用到最底层的 adam 优化器, 会根据 optimizer 中 group['params'] 
         #         的参数大小对应初始化 m 和 v, 这里也就完成了 m 和 v 的分片
@@ -379,9 +595,13 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                                 max_elements_per_comm, # s_note: 默认值 5e8, 5千万
                                 dp # s_note: 数据并行进程数
                                 ): 
+        # the default max_elements_per_comm (5e8) is a float; keep all of the
+        # interval arithmetic below in integers
+        max_elements_per_comm = int(max_elements_per_comm)
+
         # if we use max-elems-per-comm as is, how many comm intervals will there be
         # s_note: 最大可能的通信次数，上取整
-        max_comm_intervals = math.ceil(num_elements / max_elements_per_comm)
+        max_comm_intervals = -(-num_elements // max_elements_per_comm)
         # s_note: 此时，最后一次通信需要padding，padding的元素数量
         padding_for_max_comm = (max_elements_per_comm *
                                 max_comm_intervals) - num_elements
@@ -408,7 +628,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
         # z = x * (dp * min_comm_intervals) - num_elements
         # z才是padding的数量
         # s_quest: 这块没看懂？
-        padding_for_min_comm = math.ceil(num_elements / (dp * min_comm_intervals))
+        padding_for_min_comm = -(-num_elements // (dp * min_comm_intervals))
 
         # choose padding that uses least amount of overhead
         if padding_for_max_comm > padding_for_min_comm:
@@ -426,7 +646,8 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
     def get_data_parallel_sub_partitions(tensor,
                                          max_elements_per_comm,
                                          world_size,
-                                         dp_process_group=None):
+                                         dp_process_group=None,
+                                         local_rank=None):
         total_num_elements = tensor.numel()
 
         # if total elements is less than our max, revert to splitting into dp partitions
@@ -446,7 +667,11 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
         num_comm_intervals = int(num_sub_partitions // world_size)
         assert num_sub_partitions % world_size == 0, "{} % {} != 0".format(num_sub_partitions, world_size)
 
-        if not dist.is_initialized() or dist.get_rank(group=dp_process_group) == 0:
+        # Callers that already know their rank pass it in so the logging
+        # guard avoids a dist.get_rank() round-trip per call.
+        if local_rank is None and dist.is_initialized():
+            local_rank = dist.get_rank(group=dp_process_group)
+        if local_rank is None or local_rank == 0:
             logger.info("**** partition info:")
             logger.info("\t total_num_elements=%s", total_num_elements)
             logger.info("\t world_size=%s", world_size)
@@ -484,11 +709,14 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
         #   ......
         # ]
         #
+        # A single reshape yields every sub-partition at once: row idx of the
+        # view aliases the same elements the old per-idx narrow() calls did.
+        sub_partitions_view = tensor.detach().view(num_sub_partitions,
+                                                   sub_partition_size)
         for idx in range(num_sub_partitions):
             rank_id = idx % world_size
-            sub_partition = tensor.narrow(0, start, sub_partition_size).detach()
             element_intervals[rank_id].append((start, start + sub_partition_size))
-            comm_partitions[comm_id].append(sub_partition)
+            comm_partitions[comm_id].append(sub_partitions_view[idx])
             start = start + sub_partition_size
             if rank_id == (world_size - 1):
                 comm_id += 1
@@ -516,65 +744,119 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                                    all_element_intervals, # s_note: 从 self.get_data_parallel_sub_partitions 函数返回，一个rank每次通信要reduce的对应分片的起始index
                                    local_rank,
                                    world_size):
-        params_not_local = []
+        # Element index range of every tensor in the flattened group
+        sizes = np.array([tensor.numel() for tensor in tensor_list], dtype=np.int64)
+        tensor_ends = np.cumsum(sizes)
+        tensor_starts = tensor_ends - sizes
+
+        # (R, C, 2) array of the per-rank/per-comm sub-partition intervals
+        intervals = np.array([all_element_intervals[rank] for rank in range(world_size)],
+                             dtype=np.int64)
+
+        # One-shot overlap test between all tensors and all sub-partitions
+        contained, offsets = _range_check(tensor_starts,
+                                          tensor_ends,
+                                          intervals[:, :, 0],
+                                          intervals[:, :, 1])
 
         # [rank] -> [comm-id] -> [param/offset]
         params_in_rank_sub_partition = []
         params_in_rank_sub_partitions_offsets = []
 
-        # s_note: 对于每个进程
         for rank in range(world_size):
-            params_in_local_sub_partition = []
-            local_sub_partition_offsets = []
-            comm_tensor_list = []
-            comm_offset_list = []
-            current_index = 0
-            prev_comm_idx = 0
-            # s_note: 对于当前参数group中的每个参数
-            for iii, tensor in enumerate(tensor_list):
-                tensor_size = tensor.numel()
-                #if local_rank == 0:
-                #    # logger.info("rank={}, current_index={}, tensor_size={}, tensor-idx={}".format(rank,
-                #        current_index, tensor_size, iii))
-                # s_note: 本参数关联的rank的sub_partitions（以comm_idx和offset标识）
-                results_list = _range_check(current_index,
-                                            all_element_intervals[rank],
-                                            tensor_size)
-                for contained, offset, comm_idx in results_list:
-                    #if local_rank == 0:
-                    #    logger.info("rank={}, contained={}, offset={}, comm_idx={}".format(rank, contained,
-                    #        offset, comm_idx))
-                    if contained:
-                        if prev_comm_idx != comm_idx:
-                            # s_note: 进入下次通信
-                            params_in_local_sub_partition.append(comm_tensor_list)
-                            comm_tensor_list = []
-                            local_sub_partition_offsets.append(comm_offset_list)
-                            comm_offset_list = []
-                        # s_note: 当前通信相关的
-                        comm_tensor_list.append(tensor)
-                        comm_offset_list.append(offset)
-                        prev_comm_idx = comm_idx
-                    elif rank == local_rank:
-                        # s_note: 该参数本rank无需更新
-                        params_not_local.append(tensor)
-
-                current_index = current_index + tensor_size
-
-            #assert len(comm_tensor_list) > 0
-            #assert len(comm_offset_list) > 0
-            # comm -> list of parameter
-            # s_note: rank关联的每次通信要reduce grad的参数list
-            params_in_local_sub_partition.append(comm_tensor_list)
-            # s_note: 关联参数grad通信时距离参数起点index的offset
-            local_sub_partition_offsets.append(comm_offset_list)
+            rank_overlaps = np.argwhere(contained[:, rank, :])
+
+            # Trailing comm intervals that only cover alignment padding have no
+            # overlapping params; they are padded downstream via num_comm_intervals
+            num_comm = int(rank_overlaps[:, 1].max()) + 1 if rank_overlaps.size else 1
+            params_in_local_sub_partition = [[] for _ in range(num_comm)]
+            local_sub_partition_offsets = [[] for _ in range(num_comm)]
+
+            for tensor_idx, comm_idx in rank_overlaps:
+                params_in_local_sub_partition[comm_idx].append(tensor_list[tensor_idx])
+                local_sub_partition_offsets[comm_idx].append(
+                    int(offsets[tensor_idx,
+                                rank,
+                                comm_idx]))
+
+            # Pack each comm interval's offsets into one contiguous int64
+            # tensor instead of a list of Python ints (struct-of-arrays)
+            local_sub_partition_offsets = [
+                torch.tensor(comm_offsets,
+                             dtype=torch.int64)
+                for comm_offsets in local_sub_partition_offsets
+            ]
 
             # rank -> comm
             params_in_rank_sub_partition.append(params_in_local_sub_partition)
             params_in_rank_sub_partitions_offsets.append(local_sub_partition_offsets)
 
+        # params with no overlap with any of the local rank's sub-partitions
+        # will not be updated by this process: one order-preserving set
+        # difference against the params already collected for the local rank
+        local_params = set()
+        for comm_params in params_in_rank_sub_partition[local_rank]:
+            local_params.update(comm_params)
+        params_not_local = [
+            tensor for tensor in tensor_list if tensor not in local_params
+        ]
+
         return params_in_rank_sub_partition, params_in_rank_sub_partitions_offsets, params_not_local
 
+    # Precompute, for every rank and comm interval, exactly which slice of
+    # which param's grad is copied to which offset of the flat sub-partition.
+    # This mirrors the offset/clamp logic of get_flat_sub_partitions but runs
+    # once at init; the per-step path just replays the plan.
+    @staticmethod
+    def _build_sub_partition_copy_plans(params_in_rank_sub_partition,
+                                        params_in_rank_sub_partitions_offsets,
+                                        sub_partition_size,
+                                        num_comm_intervals):
+        sub_partition_size = int(sub_partition_size)
+        # [rank] -> [comm-id] -> [(param, src_offset, dst_offset, numel)]
+        copy_plans = []
+        for rank_params, rank_offsets in zip(params_in_rank_sub_partition,
+                                             params_in_rank_sub_partitions_offsets):
+            rank_plan = []
+            for tensor_list, param_offsets in zip(rank_params, rank_offsets):
+                interval_plan = []
+                current_size = 0
+                for i, param in enumerate(tensor_list):
+                    num_elements = param.numel()
+                    tensor_offset = 0
+                    if i == 0 and int(param_offsets[0]) > 0:
+                        tensor_offset = int(param_offsets[0])
+                        num_elements = num_elements - tensor_offset
+                    if num_elements > (sub_partition_size - current_size):
+                        num_elements = sub_partition_size - current_size
+                    interval_plan.append(
+                        (param,
+                         int(tensor_offset),
+                         int(current_size),
+                         int(num_elements)))
+                    current_size = current_size + num_elements
+                rank_plan.append(interval_plan)
+            # trailing intervals that only cover alignment padding
+            while len(rank_plan) < num_comm_intervals:
+                rank_plan.append([])
+            copy_plans.append(rank_plan)
+        return copy_plans
+
+    # Replay a precomputed copy plan into a flat staging buffer.
+    @staticmethod
+    def _flatten_sub_partition_from_plan(interval_plan, flat_buffer):
+        flat_buffer.zero_()
+        for param, src_offset, dst_offset, num_elements in interval_plan:
+            if param.grad is not None:
+                flat_buffer.narrow(0,
+                                   dst_offset,
+                                   num_elements).copy_(
+                                       param.grad.contiguous().view(-1).narrow(
+                                           0,
+                                           src_offset,
+                                           num_elements))
+        return flat_buffer
+
     # 返回的flat sub partition grad
     @staticmethod
     def get_flat_sub_partitions(comm_tensor_list,
@@ -583,32 +865,47 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                                 dtype,
                                 default_device,
                                 num_comm_intervals=None,
-                                return_partition_params=False):
+                                return_partition_params=False,
+                                out_buffers=None):
 
         partition_params = []
         final_param_offsets = []
         flat_sub_partitions = []
-        for tensor_list, param_offsets in zip(comm_tensor_list, comm_param_offsets):
-            flat_tensor_list = []
+        for idx, (tensor_list,
+                  param_offsets) in enumerate(zip(comm_tensor_list,
+                                                  comm_param_offsets)):
             current_size = 0
             my_offsets = []
             my_params = []
 
-            for i, tensor in enumerate(tensor_list):
-                if tensor.grad is None:
-                    tensor.grad = torch.zeros(tensor.size(),
-                                              dtype=tensor.dtype,
-                                              device=tensor.device)
-                # s_note: 参数
-                param = tensor
+            if len(tensor_list) == 0:
+                assert default_device != None
+                device = default_device
+            else:
+                device = tensor_list[0].device
+
+            # Stage all grad slices for this sub-partition into one preallocated
+            # buffer with a single cast+copy per param, instead of materializing
+            # per-param narrow/contiguous/to(dtype) temporaries and re-flattening.
+            # Zero-init also covers any tail padding below. Callers may pass
+            # reusable staging buffers via out_buffers to skip the allocation.
+            if out_buffers is not None:
+                flat_sub_partition = out_buffers[idx]
+                flat_sub_partition.zero_()
+            else:
+                flat_sub_partition = torch.zeros(int(sub_partition_size),
+                                                 dtype=dtype,
+                                                 device=device)
+
+            for i, param in enumerate(tensor_list):
                 # s_note: 参数的grad
-                tensor = tensor.grad
-                num_elements = tensor.numel()
+                grad = param.grad
+                num_elements = param.numel()
                 tensor_offset = 0
 
                 #we need to offset to get to the right element
-                if i == 0 and param_offsets[i] > 0:
-                    tensor_offset = param_offsets[i]
+                if i == 0 and int(param_offsets[0]) > 0:
+                    tensor_offset = int(param_offsets[0])
                     num_elements = num_elements - tensor_offset
 
                 # We don't need all elements of the tensor if this tensor is
@@ -616,18 +913,18 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                 if num_elements > (sub_partition_size - current_size):
                     num_elements = sub_partition_size - current_size
 
-                #we need a narrow view of the tensor based on the tensor offset and number of elements that
-                #we need from this tensor
-                if tensor_offset > 0 or num_elements < tensor.numel():
-                    # s_note: 参数的梯度flatten
-                    # s_note: tesnor.view, 数据共享，解释方式不同 https://pytorch.org/docs/stable/tensor_view.html
+                # Params that never received a grad contribute zeros; the
+                # zero-init of the staging buffer already provides them, so
+                # there is no need to materialize a full-size zero grad.
+                if grad is not None:
                     # s_note: 裁剪出该para的grad在该sub_partiton的部分
-                    flat_tensor_list.append(tensor.contiguous().view(-1).narrow(
-                        0,
-                        int(tensor_offset),
-                        int(num_elements)).to(dtype))
-                else:
-                    flat_tensor_list.append(tensor.to(dtype))
+                    flat_sub_partition.narrow(0,
+                                              int(current_size),
+                                              int(num_elements)).copy_(
+                                                  grad.contiguous().view(-1).narrow(
+                                                      0,
+                                                      int(tensor_offset),
+                                                      int(num_elements)))
                 my_params.append(param)
 
                 #remember offset into partition and #elems for this tensor
@@ -635,35 +932,29 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
 
                 current_size = current_size + num_elements
 
-            #this means its the last partition and does not align with the dp boundary. We need to pad before flattening
+            #this means its the last partition and does not align with the dp boundary
             if current_size < sub_partition_size:
                 my_offsets.append((None, None))
                 my_params.append(None)
-                if len(tensor_list) == 0:
-                    assert default_device != None
-                    flat_tensor_list.append(
-                        torch.zeros(int(sub_partition_size - current_size),
-                                    dtype=dtype,
-                                    device=default_device))
-                else:
-                    flat_tensor_list.append(
-                        torch.zeros(int(sub_partition_size - current_size),
-                                    dtype=dtype,
-                                    device=tensor_list[0].device))
-            partition_params.append(my_params)  #flat_tensor_list)
+            partition_params.append(my_params)
             final_param_offsets.append(my_offsets)
-            assert len(flat_tensor_list) == len(my_offsets), "{} {}".format(len(flat_tensor_list), len(my_offsets))
             # s_note: flat sub partition grad
-            flat_sub_partitions.append(_flatten_dense_tensors(flat_tensor_list))
+            flat_sub_partitions.append(flat_sub_partition)
         if num_comm_intervals is not None and len(
                 flat_sub_partitions) < num_comm_intervals:
             # logger.info("padding w. sub partitions to ensure uniform communication")
             device = flat_sub_partitions[0].device
             for _ in range(num_comm_intervals - len(flat_sub_partitions)):
-                flat_sub_partitions.append(
-                    torch.zeros(int(sub_partition_size),
-                                dtype=dtype,
-                                device=device))
+                if out_buffers is not None:
+                    pad_partition = out_buffers[len(flat_sub_partitions)]
+                    pad_partition.zero_()
+                else:
+                    # private buffer: callers may legally write into a pad
+                    # partition (e.g. as a collective's output slot)
+                    pad_partition = torch.zeros(int(sub_partition_size),
+                                                dtype=dtype,
+                                                device=device)
+                flat_sub_partitions.append(pad_partition)
                 partition_params.append([None])
                 final_param_offsets.append([(None, None)])
 
@@ -688,77 +979,198 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                         p.grad.detach_()
                         p.grad.zero_()
 
+    # param_list must already be flat; the nested per-interval lists are
+    # flattened once at init (see local_rank_params_flat)
     def free_grad_in_param_list(self, param_list):
         for p in param_list:
-            if isinstance(p, list):
-                for _p in p:
-                    _p.grad = None
-            else:
-                p.grad = None
+            p.grad = None
 
     # s_note: loss.backward()之后的grad split & reduce-scatter
     def reduce_scatter_gradients(self,
                                  postscale_gradients,
                                  gradient_predivide_factor,
                                  gradient_average):
-        world_size = dist.get_world_size(group=self.dp_process_group)
-        local_rank = dist.get_rank(group=self.dp_process_group)
-
-        for i, group in enumerate(self.fp16_groups):
-            # s_note: 对于第i个参数
-            # s_note: 获取其需要的通信次数
-            num_comm_intervals = self.num_comm_intervals_per_group[i]
-
-            # 遍历world_size个进程
-            # 记录该参数的所有grad分片的view
-            all_sub_partitions = []
-            for rank in range(world_size):
-                # gsp is list of partitions indexed by comm_idx
-                # s_note: 获取本进程本参数现有的 fp16 梯度分片的view
-                # s_note: comm -> fp16 sub partitions
-                grad_sub_partitions = self.get_flat_sub_partitions(
-                    comm_tensor_list=self.params_in_rank_sub_partitions[i][rank],
-                    comm_param_offsets=self.params_in_rank_sub_partitions_offsets[i]
-                    [rank],
-                    dtype=torch.half,
-                    default_device=self.default_device,
-                    sub_partition_size=self.sub_partition_sizes[i],
-                    num_comm_intervals=self.num_comm_intervals_per_group[i])
-                # rank -> comm
-                all_sub_partitions.append(grad_sub_partitions)
-
-                assert len(grad_sub_partitions) == num_comm_intervals
-
-            local_comm_partitions = []
-            # s_note: 分为 num_comm_intervals 次通信
-            for comm_idx in range(num_comm_intervals):
-                single_comm_all_partitions = []
-                for rank in range(world_size):
-                    # s_note: 汇总本次通信在本进程关联的多个grad分片
-                    # s_note: rank -> grad sub partitions
-                    single_comm_all_partitions.append(all_sub_partitions[rank][comm_idx])
-
-                if postscale_gradients:
-                    if gradient_predivide_factor != 1.0:
-                        for partition in single_comm_all_partitions:
-                            partition.mul_(1. / gradient_predivide_factor)
-
-                    dist.reduce_scatter(output=single_comm_all_partitions[local_rank],
-                                        input_list=single_comm_all_partitions,
-                                        group=self.dp_process_group)
-
-                    if gradient_average:
-                        # Only need to average our local grads in post scaling
-                        if gradient_predivide_factor != world_size:
-                            single_comm_all_partitions[local_rank].mul_(
-                                gradient_predivide_factor / world_size)
-                else:
-                    for partition in single_comm_all_partitions:
-                        partition.div_(world_size)
-                    # s_note: reduce_scatter 全局同步分发  fp16 梯度 
-                    dist.reduce_scatter(output=single_comm_all_partitions[local_rank],
-                                        input_list=single_comm_all_partitions,
-                                        group=self.dp_process_group)
+        world_size = self.partition_count
+        local_rank = self.local_rank
+
+        # single rank: nothing to scatter, and the staging/scaling below
+        # would only burn memory bandwidth reproducing the local grads
+        if world_size == 1:
+            return
+
+        # In-flight async collectives, keyed like the staging buckets:
+        # (group_idx, parity) -> (work, local_partition, post_scale, plan).
+        # A bucket's previous collective is waited on (and its deferred
+        # post-scaling applied) only when the bucket is about to be reused,
+        # so NCCL runs while the next interval is being staged and pre-scaled.
+        pending_reduces = {}
+
+        # Decide once how this call scales gradients. When ReduceOp.AVG is
+        # available the divide-by-world-size happens inside the collective
+        # with zero extra memory traffic; otherwise fall back to explicit
+        # pre/post scaling kernels.
+        reduce_op = dist.ReduceOp.SUM
+        predivide_scale = None
+        deferred_post_scale = None
+        # The predivide pass exists to keep the cross-rank sum inside fp16
+        # range; when grads are staged and reduced in bf16 the exponent
+        # range matches fp32, so the whole scale can be folded into one
+        # post-collective mul_ over just the local 1/world_size shard
+        # instead of a bucket-wide pass on every rank plus a second local
+        # pass (scaling commutes with the sum).
+        defer_all_scaling = self.grad_reduce_dtype is not torch.half
+        if postscale_gradients:
+            if self._reduce_op_avg and gradient_average \
+                    and gradient_predivide_factor == world_size:
+                # pre-dividing by world_size then summing is exactly AVG
+                reduce_op = dist.ReduceOp.AVG
+            elif defer_all_scaling:
+                if gradient_average:
+                    deferred_post_scale = 1. / world_size
+                elif gradient_predivide_factor != 1.0:
+                    deferred_post_scale = 1. / gradient_predivide_factor
+            else:
+                if gradient_predivide_factor != 1.0:
+                    predivide_scale = 1. / gradient_predivide_factor
+                # Only need to average our local grads in post scaling
+                if gradient_average and gradient_predivide_factor != world_size:
+                    deferred_post_scale = gradient_predivide_factor / world_size
+        else:
+            if self._reduce_op_avg:
+                reduce_op = dist.ReduceOp.AVG
+            elif defer_all_scaling:
+                deferred_post_scale = 1. / world_size
+            else:
+                predivide_scale = 1. / world_size
+
+        def _retire(entry_key):
+            entry = pending_reduces.pop(entry_key, None)
+            if entry is None:
+                return
+            work, local_partition, post_scale, plan = entry
+            work.wait()
+            if post_scale is not None:
+                local_partition.mul_(post_scale)
+            # Scatter the reduced sub-partition back into the local rank's
+            # fp16 grad slices by running this interval's copy plan in
+            # reverse (copy_ also casts back from the reduce dtype). The
+            # staging buckets are transient, so without this step() would
+            # consume the raw pre-reduction grads.
+            for param, src_offset, dst_offset, num_elements in plan:
+                if param.grad is not None:
+                    param.grad.data.view(-1).narrow(0,
+                                                    src_offset,
+                                                    num_elements).copy_(
+                                                        local_partition.narrow(
+                                                            0,
+                                                            dst_offset,
+                                                            num_elements))
+
+        # s_note: 分为 num_comm_intervals 次通信
+        # Intervals are processed in flights of two (one per staging
+        # bucket), with the same comm interval of EVERY group staged into
+        # the same flight: all of a flight's reduce-scatters are submitted
+        # together - inside one ncclGroupStart/End when the coalescing
+        # context is available - so models with many param groups (e.g.
+        # decay/no-decay splits) still produce one fused NCCL submission
+        # per flight instead of num_groups fragmented ones.
+        max_comm_intervals = max(self.num_comm_intervals_per_group)
+        for base_idx in range(0, max_comm_intervals, 2):
+            staged = []
+            for comm_idx in range(base_idx,
+                                  min(base_idx + 2,
+                                      max_comm_intervals)):
+                parity = comm_idx % 2
+                for i in range(len(self.fp16_groups)):
+                    if comm_idx >= self.num_comm_intervals_per_group[i]:
+                        continue
+                    bucket = self._grad_reduce_buckets[i][parity]
+                    entry_key = (i, parity)
+                    # don't re-fill this bucket until the collective that
+                    # last read it is done; work.wait() orders our stream
+                    # behind the comm stream without blocking the host
+                    _retire(entry_key)
+                    single_comm_all_partitions = []
+                    for rank in range(world_size):
+                        # s_note: 汇总本次通信在本进程关联的多个grad分片
+                        grad_sub_partition = self._flatten_sub_partition_from_plan(
+                            self.sub_partition_copy_plans[i][rank][comm_idx],
+                            bucket[rank])
+                        single_comm_all_partitions.append(grad_sub_partition)
+
+                    if predivide_scale is not None:
+                        # the partitions are the rows of one contiguous
+                        # bucket, so a single bucket-wide mul_ replaces the
+                        # per-partition kernel launches
+                        bucket.mul_(predivide_scale)
+
+                    staged.append(
+                        (entry_key,
+                         bucket,
+                         single_comm_all_partitions,
+                         deferred_post_scale,
+                         self.sub_partition_copy_plans[i][local_rank][comm_idx]))
+
+            # s_note: reduce_scatter 全局同步分发  fp16 梯度 
+            if self._use_comm_coalescing and len(staged) > 1:
+                with dist._coalescing_manager(group=self.dp_process_group,
+                                              device=self.default_device,
+                                              async_ops=True) as cm:
+                    for entry_key, bucket, partitions, post_scale, plan in staged:
+                        dist.reduce_scatter(output=partitions[local_rank],
+                                            input_list=partitions,
+                                            op=reduce_op,
+                                            group=self.dp_process_group,
+                                            async_op=True)
+                works = [cm for _ in staged]
+            else:
+                works = [
+                    dist.reduce_scatter(output=partitions[local_rank],
+                                        input_list=partitions,
+                                        op=reduce_op,
+                                        group=self.dp_process_group,
+                                        async_op=True) for _,
+                    _,
+                    partitions,
+                    _,
+                    _ in staged
+                ]
+
+            for (entry_key, bucket, partitions, post_scale, plan), work in zip(staged, works):
+                pending_reduces[entry_key] = (work,
+                                              partitions[local_rank],
+                                              post_scale,
+                                              plan)
+
+        # drain whatever is still in flight
+        for entry_key in list(pending_reduces.keys()):
+            _retire(entry_key)
+
+    def _get_group_grad_norm(self, group):
+        # Fused fast path for the pure data-parallel case: one multi-tensor
+        # kernel for all per-param norms and a single host sync for the
+        # group, instead of one .norm().item() round-trip per parameter.
+        # Model parallelism needs get_grad_norm's per-param rank filtering.
+        if self.mpu is not None or not self._foreach_norm_fp32:
+            return get_grad_norm(group, mpu=self.mpu)
+
+        grads = [p.grad.data for p in group if p.grad is not None]
+        if len(grads) == 0:
+            return torch.zeros(1, device=self.default_device).squeeze()
+
+        # fp32 accumulation: in fp16 the per-tensor norms themselves would
+        # overflow to inf and poison the total via the -1 sentinel below
+        group_norms = _foreach_norm(grads, 2.0, dtype=torch.float)
+        total_norm = torch.stack(group_norms).pow(2).sum().sqrt()
+
+        # match get_grad_norm's -1 sentinel for inf/nan, but keep the norm
+        # on device - the only host sync happens once per step when
+        # unscale_and_clip_grads reads the combined scale
+        total_norm = torch.where(torch.isfinite(total_norm),
+                                 total_norm,
+                                 torch.full_like(total_norm,
+                                                 -1.))
+        return total_norm
 
     # s_note: stage 1 parameter update
     def step(self, closure=None):
@@ -779,11 +1191,11 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
         norm_groups = []
         local_sub_partitions_grad_groups = []
 
-        partition_id = dist.get_rank(group=self.dp_process_group)
+        partition_id = self.local_rank
         # s_note: 对于每个group的参数
         for i, group in enumerate(self.fp16_groups):
             #TODO RS: update get grad norm to support sub partitions
-            norm_groups.append(get_grad_norm(group, mpu=self.mpu))
+            norm_groups.append(self._get_group_grad_norm(group))
 
             #RS: update free grads w.r.t. sub partitions
             #free gradients for all the parameters that are not updated by this process
@@ -794,14 +1206,18 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
 
             # create flat gradient partitions for parameters updated by this process
             # s_note: 本rank要更新的grad sub-partitons fp32
-            local_grad_sub_partitions = self.get_flat_sub_partitions(
-                comm_tensor_list=self.params_in_rank_sub_partitions[i][partition_id],
-                comm_param_offsets=self.params_in_rank_sub_partitions_offsets[i]
-                [partition_id],
-                sub_partition_size=self.sub_partition_sizes[i],
-                dtype=self.local_sub_partitions_of_fp32_groups[i][0].dtype,
-                num_comm_intervals=self.num_comm_intervals_per_group[i],
-                default_device=self.default_device)
+            # Replay the init-time copy plans straight into the persistent
+            # fp32 grad buffers. The fp16 -> fp32 upcast happens inside each
+            # copy_, so there is no intermediate fp16 flat grad and no second
+            # widening pass - each grad byte is read once here, and the
+            # optimizer math stays fp32.
+            local_grad_sub_partitions = [
+                self._flatten_sub_partition_from_plan(interval_plan,
+                                                      grad_buffer)
+                for interval_plan,
+                grad_buffer in zip(self.sub_partition_copy_plans[i][partition_id],
+                                   self.local_fp32_grad_sub_partitions[i])
+            ]
 
             #RS: update all our local params with sub-partition grads
             for idx, sub_partition_param in enumerate(self.local_sub_partitions_of_fp32_groups[i]):
@@ -810,8 +1226,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
             #RS: update free grads for sub-partitions
             # release all the gradient since we have already created a necessary copy in dp_grad_partition
             # s_note: 这里释放了 fp16 的梯度? 这应该是 stege2 才要做的事情? 还有上面 dp_grad_partition 指什么?
-            self.free_grad_in_param_list(
-                self.params_in_rank_sub_partitions[i][partition_id])
+            self.free_grad_in_param_list(self.local_rank_params_flat[i])
 
             local_sub_partitions_grad_groups.append(local_grad_sub_partitions)
 
@@ -830,52 +1245,116 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
             #group.grad = None
 
         #NOTE RS: removed norm_groups outer loop from original code, i don't think it's needed
-        #RS: copy all sub-partition fp32 data to fp16 sub partitions
-        # copy fp32 param data to fp16 partitions w.r.t. our local rank
-        for fp16_all_sub_partitions, fp32_local_sub_partitions in zip(self.parallel_sub_partitioned_fp16_groups, self.local_sub_partitions_of_fp32_groups):
-            for local_sub_partition_param_fp16, local_sub_partition_param_fp32 in zip(fp16_all_sub_partitions[partition_id], fp32_local_sub_partitions):
-                local_sub_partition_param_fp16.data.copy_(
-                    local_sub_partition_param_fp32.data)
-
-        #RS: all_gather/broadcast sub-partitions in separate comm calls
+        #RS: copy all sub-partition fp32 data to fp16 sub partitions, then
         #gather the updated weights from everyone
         # s_note: all_gather 获取全局更新之后的 fp16 参数
-        for fp16_all_sub_partitions in self.parallel_comm_sub_partitioned_fp16_groups:
-            for comm_id, sub_partitions in enumerate(fp16_all_sub_partitions):
-                dist.all_gather(sub_partitions,
-                                sub_partitions[partition_id],
-                                group=self.dp_process_group)
-
-        # TODO: we probably don't need this? just to be safe
-        for i in range(len(norm_groups)):
-            updated_params = _unflatten_dense_tensors(self.fp16_groups_flat[i],
-                                                      self.fp16_groups[i])
-            for p, q in zip(self.fp16_groups[i], updated_params):
-                p.data = q.data
+        # Per group: run the fp32 -> fp16 copies on the dedicated copy
+        # stream, fence the comm launches on a per-group event, and issue
+        # that group's gathers asynchronously (coalesced when available).
+        # Group g's all_gather then overlaps group g+1's copies, and the
+        # final wait drains everything at once.
+        all_gather_handles = []
+        for fp16_all_sub_partitions, fp32_local_sub_partitions, fp16_comm_sub_partitions in zip(
+                self.parallel_sub_partitioned_fp16_groups,
+                self.local_sub_partitions_of_fp32_groups,
+                self.parallel_comm_sub_partitioned_fp16_groups):
+            fp16_dsts = [
+                sub_partition.data
+                for sub_partition in fp16_all_sub_partitions[partition_id]
+            ]
+            fp32_srcs = [sub_partition.data for sub_partition in fp32_local_sub_partitions]
+            if self._copy_stream is not None:
+                self._copy_stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(self._copy_stream):
+                    self._copy_fp32_to_fp16(fp16_dsts, fp32_srcs)
+                    copies_done = torch.cuda.Event()
+                    copies_done.record()
+                torch.cuda.current_stream().wait_event(copies_done)
+            else:
+                self._copy_fp32_to_fp16(fp16_dsts, fp32_srcs)
+
+            if self.partition_count == 1:
+                # single rank already holds every sub-partition; the copies
+                # above are the whole update
+                continue
+            if self._use_comm_coalescing:
+                with dist._coalescing_manager(group=self.dp_process_group,
+                                              device=self.default_device,
+                                              async_ops=True) as cm:
+                    for comm_id, sub_partitions in enumerate(fp16_comm_sub_partitions):
+                        dist.all_gather(sub_partitions,
+                                        sub_partitions[partition_id],
+                                        group=self.dp_process_group,
+                                        async_op=True)
+                all_gather_handles.append(cm)
+            else:
+                for comm_id, sub_partitions in enumerate(fp16_comm_sub_partitions):
+                    handle = dist.all_gather(sub_partitions,
+                                             sub_partitions[partition_id],
+                                             group=self.dp_process_group,
+                                             async_op=True)
+                    all_gather_handles.append(handle)
+
+        for handle in all_gather_handles:
+            handle.wait()
+
+        # No unflatten/rebind pass here: every fp16 param's .data is a
+        # narrow() view of fp16_groups_flat (set up at init), so the
+        # all_gather above already updated the params in place.
 
         return self.overflow
 
+    # One multi-tensor kernel for a group's fp32 -> fp16 copy-back instead
+    # of one launch per sub-partition; falls back to the per-tensor loop on
+    # torch builds without _foreach_copy_.
+    @staticmethod
+    def _copy_fp32_to_fp16(fp16_dsts, fp32_srcs):
+        if _foreach_copy is not None:
+            _foreach_copy(fp16_dsts, fp32_srcs)
+        else:
+            for fp16_dst, fp32_src in zip(fp16_dsts, fp32_srcs):
+                fp16_dst.copy_(fp32_src, non_blocking=True)
+
     def unscale_and_clip_grads(self, grad_groups_flat, norm_groups):
-        total_norm = 0.0
-        for norm in norm_groups:
-            total_norm += norm**2.0
-        total_norm = math.sqrt(total_norm)
+        # group norms arrive as 0-dim device tensors from the fused norm
+        # path; combining them with tensor ops keeps the whole clip-scale
+        # computation on device so there is exactly one host sync below,
+        # instead of one per group. The model-parallel path still yields
+        # Python floats and keeps the scalar math.
+        if all(torch.is_tensor(norm) for norm in norm_groups):
+            total_norm = torch.stack(norm_groups).pow(2).sum().sqrt()
+        else:
+            total_norm = math.sqrt(sum(float(norm)**2.0 for norm in norm_groups))
 
         # compute combined scale factor for this group
         combined_scale = self.loss_scale
         if self.clip_grad > 0.:
             # norm is in fact norm*scale
             clip = ((total_norm / self.loss_scale) + 1e-6) / self.clip_grad
-            if clip > 1:
+            if torch.is_tensor(clip):
+                # branchless equivalent of `if clip > 1` without a sync
+                combined_scale = torch.clamp(clip, min=1.0) * self.loss_scale
+            elif clip > 1:
                 combined_scale = clip * self.loss_scale
 
+        inv_scale = 1. / combined_scale
+        if torch.is_tensor(inv_scale):
+            # the single device -> host sync of the whole norm/scale chain
+            inv_scale = inv_scale.item()
+
+        all_sub_partition_grads = []
         for grad in grad_groups_flat:
             if isinstance(grad, list):
-                sub_partitions = grad
-                for g in sub_partitions:
-                    g.data.mul_(1. / combined_scale)
+                all_sub_partition_grads.extend(g.data for g in grad)
             else:
-                grad.data.mul_(1. / combined_scale)
+                all_sub_partition_grads.append(grad.data)
+
+        if _foreach_mul is not None:
+            # one fused multi-tensor kernel over every sub-partition grad
+            _foreach_mul(all_sub_partition_grads, inv_scale)
+        else:
+            for g in all_sub_partition_grads:
+                g.mul_(inv_scale)
 
     def backward(self, loss, retain_graph=False):
         self.loss_scaler.backward(loss.float(), retain_graph=retain_graph)
@@ -914,7 +1393,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
 
     # Return communication interval paddings for local rank and group
     def _get_local_group_paddings(self, group_index):
-        local_rank = dist.get_rank(group=self.dp_process_group)
+        local_rank = self.local_rank
         sub_partition_indices = [
             local_rank + (comm_idx * self.partition_count)
             for comm_idx in range(self.num_comm_intervals_per_group[group_index])
@@ -1041,20 +1520,15 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
     def _retrieve_group_sub_partition_weights(self,
                                               all_partition_fp32_weights,
                                               max_elems_per_comm):
-        num_partitions = len(all_partition_fp32_weights)
-        num_comm_intervals = len(all_partition_fp32_weights[0])
-        num_sub_partitions = num_partitions * num_comm_intervals
-        all_sub_partition_weights = [None] * num_sub_partitions
-
-        for rank, partition_weights in enumerate(all_partition_fp32_weights):
-            for comm_idx, sub_partition_weights in enumerate(partition_weights):
-                #all_sub_partition_weights.append(sub_partition_weights)
-                sub_partition_idx = (comm_idx * num_partitions) + rank
-                all_sub_partition_weights[sub_partition_idx] = sub_partition_weights
+        # comm-major interleave: zip(*ranks) yields one tuple of per-rank
+        # sub-partitions per comm interval, which chained together is the
+        # (comm_idx * num_partitions) + rank ordering the flatten expects
+        all_sub_partition_weights = list(
+            itertools.chain.from_iterable(zip(*all_partition_fp32_weights)))
 
         flat_merged_weights = flatten_dense_tensors_sub_partition_aligned(
             tensor_list=all_sub_partition_weights,
-            dp=dist.get_world_size(group=self.dp_process_group),
+            dp=self.partition_count,
             max_elements_per_comm=max_elems_per_comm,
             pg=self.dp_process_group)
 
@@ -1062,11 +1536,12 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
             self.get_data_parallel_sub_partitions(
                 tensor=flat_merged_weights,
                 max_elements_per_comm=max_elems_per_comm,
-                world_size=dist.get_world_size(group=self.dp_process_group),
-                dp_process_group=self.dp_process_group
+                world_size=self.partition_count,
+                dp_process_group=self.dp_process_group,
+                local_rank=self.local_rank
             )
 
-        partition_id = dist.get_rank(group=self.dp_process_group)
+        partition_id = self.local_rank
         return [sub_partition for sub_partition in dp_sub_partitions[partition_id]]
 
     # Restore base optimizer fp32 weights from checkpoint by:
@@ -1099,10 +1574,10 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
         if not torch.is_tensor(all_partition_states[0]):
             return all_partition_states[0]
 
-        alignment = dist.get_world_size(group=self.dp_process_group)
+        alignment = self.partition_count
         flat_merged_partitions = flatten_dense_tensors_sub_partition_aligned(
             tensor_list=all_partition_states,
-            dp=dist.get_world_size(group=self.dp_process_group),
+            dp=self.partition_count,
             max_elements_per_comm=max_elems_per_comm,
             pg=self.dp_process_group)
 
@@ -1110,11 +1585,12 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
             self.get_data_parallel_sub_partitions(
                 tensor=flat_merged_partitions,
                 max_elements_per_comm=max_elems_per_comm,
-                world_size=dist.get_world_size(group=self.dp_process_group),
-                dp_process_group=self.dp_process_group
+                world_size=self.partition_count,
+                dp_process_group=self.dp_process_group,
+                local_rank=self.local_rank
             )
 
-        partition_id = dist.get_rank(group=self.dp_process_group)
+        partition_id = self.local_rank
         return [sub_partition for sub_partition in dp_sub_partitions[partition_id]]
 
     # Compute the optimizer state partitions for the group by
@@ -1172,7 +1648,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
 
     # Restore base optimizer fp32 weights from ZeRO fp16 weights
     def _restore_from_fp16_weights(self):
-        partition_id = dist.get_rank(group=self.dp_process_group)
+        partition_id = self.local_rank
         for fp16_partitions, fp32_partitions in zip(self.parallel_sub_partitioned_fp16_groups, self.local_sub_partitions_of_fp32_groups):
             for fp16_sub_partition, fp32_sub_partition in zip(fp16_partitions[partition_id], fp32_partitions):
                 fp32_sub_partition.data.copy_(fp16_sub_partition.data)
@@ -1251,7 +1727,7 @@ class FP16_DeepSpeedZeroOptimizer_Stage1(object):
                                           load_from_fp32_weights)
         else:
             self._rigid_load_state_dict(
-                state_dict_list[dist.get_rank(group=self.dp_process_group)],
+                state_dict_list[self.local_rank],
                 load_optimizer_states)
 
     def _dump_optimizer_state(self, message):
@@ -0,0 +1,355 @@
+import random
+import types
+
+import torch
+from torch._utils import _flatten_dense_tensors
+
+from deepspeed.runtime.zero.stage1 import FP16_DeepSpeedZeroOptimizer_Stage1
+from deepspeed.runtime.zero.stage1 import flatten_dense_tensors_sub_partition_aligned
+from deepspeed.runtime.zero.stage1 import get_group_alignment_padding
+
+# Scalar reference implementations, transcribed from the original
+# (pre-vectorization) stage1.py. The tests below check the rewritten fast
+# paths against these over randomized partition layouts; everything here is
+# pure CPU and needs no process group.
+
+
+def _ref_get_alignment_padding(flattened_lean_size,
+                               sub_partition_id,
+                               sub_partition_size):
+    sub_partition_high_limit = (sub_partition_id + 1) * sub_partition_size
+    if sub_partition_high_limit <= flattened_lean_size:
+        return 0
+    else:
+        return min(sub_partition_size,
+                   sub_partition_high_limit - flattened_lean_size)
+
+
+def _ref_group_alignment_padding(tensor_list,
+                                 sub_partition_size,
+                                 sub_partition_count):
+    group_paddings = []
+    flattened_size = sum([tensor.numel() for tensor in tensor_list])
+    for i in range(sub_partition_count):
+        group_paddings.append(
+            _ref_get_alignment_padding(flattened_size,
+                                       i,
+                                       sub_partition_size))
+    return group_paddings
+
+
+def _ref_single_range_check(current_index, start_index, end_index, tensor_size):
+    offset = 0
+    if (current_index >= start_index) and (current_index < end_index):
+        # Fully inside bounds
+        return True, offset
+    elif (start_index > current_index) and (start_index <
+                                            (current_index + tensor_size)):
+        # Partially contained, compute offset
+        offset = start_index - current_index
+        return True, offset
+    else:
+        return False, offset
+
+
+def _ref_range_check(current_index, element_intervals, tensor_size):
+    results = []
+    for comm_idx, interval in enumerate(element_intervals):
+        start_index, end_index = interval
+        contained, offset = _ref_single_range_check(current_index,
+                                                    start_index,
+                                                    end_index,
+                                                    tensor_size)
+        if contained:
+            results.append((contained, offset, comm_idx))
+    if len(results) == 0:
+        return [(False, 0, -1)]
+    return results
+
+
+def _ref_get_all_sub_partition_info(tensor_list,
+                                    all_element_intervals,
+                                    local_rank,
+                                    world_size):
+    params_not_local = []
+    params_in_rank_sub_partition = []
+    params_in_rank_sub_partitions_offsets = []
+
+    for rank in range(world_size):
+        params_in_local_sub_partition = []
+        local_sub_partition_offsets = []
+        comm_tensor_list = []
+        comm_offset_list = []
+        current_index = 0
+        prev_comm_idx = 0
+        for iii, tensor in enumerate(tensor_list):
+            tensor_size = tensor.numel()
+            results_list = _ref_range_check(current_index,
+                                            all_element_intervals[rank],
+                                            tensor_size)
+            for contained, offset, comm_idx in results_list:
+                if contained:
+                    if prev_comm_idx != comm_idx:
+                        params_in_local_sub_partition.append(comm_tensor_list)
+                        comm_tensor_list = []
+                        local_sub_partition_offsets.append(comm_offset_list)
+                        comm_offset_list = []
+                    comm_tensor_list.append(tensor)
+                    comm_offset_list.append(offset)
+                    prev_comm_idx = comm_idx
+                elif rank == local_rank:
+                    params_not_local.append(tensor)
+
+            current_index = current_index + tensor_size
+
+        params_in_local_sub_partition.append(comm_tensor_list)
+        local_sub_partition_offsets.append(comm_offset_list)
+
+        params_in_rank_sub_partition.append(params_in_local_sub_partition)
+        params_in_rank_sub_partitions_offsets.append(local_sub_partition_offsets)
+
+    return params_in_rank_sub_partition, params_in_rank_sub_partitions_offsets, params_not_local
+
+
+def _ref_get_flat_sub_partitions(comm_tensor_list,
+                                 comm_param_offsets,
+                                 sub_partition_size,
+                                 dtype,
+                                 default_device,
+                                 num_comm_intervals=None):
+    flat_sub_partitions = []
+    for tensor_list, param_offsets in zip(comm_tensor_list, comm_param_offsets):
+        flat_tensor_list = []
+        current_size = 0
+        for i, tensor in enumerate(tensor_list):
+            if tensor.grad is None:
+                tensor.grad = torch.zeros(tensor.size(),
+                                          dtype=tensor.dtype,
+                                          device=tensor.device)
+            tensor = tensor.grad
+            num_elements = tensor.numel()
+            tensor_offset = 0
+            if i == 0 and param_offsets[i] > 0:
+                tensor_offset = param_offsets[i]
+                num_elements = num_elements - tensor_offset
+            if num_elements > (sub_partition_size - current_size):
+                num_elements = sub_partition_size - current_size
+            if tensor_offset > 0 or num_elements < tensor.numel():
+                flat_tensor_list.append(tensor.contiguous().view(-1).narrow(
+                    0,
+                    int(tensor_offset),
+                    int(num_elements)).to(dtype))
+            else:
+                flat_tensor_list.append(tensor.to(dtype))
+            current_size = current_size + num_elements
+        if current_size < sub_partition_size:
+            if len(tensor_list) == 0:
+                assert default_device != None
+                flat_tensor_list.append(
+                    torch.zeros(int(sub_partition_size - current_size),
+                                dtype=dtype,
+                                device=default_device))
+            else:
+                flat_tensor_list.append(
+                    torch.zeros(int(sub_partition_size - current_size),
+                                dtype=dtype,
+                                device=tensor_list[0].device))
+        flat_sub_partitions.append(_flatten_dense_tensors(flat_tensor_list))
+    if num_comm_intervals is not None and len(
+            flat_sub_partitions) < num_comm_intervals:
+        device = flat_sub_partitions[0].device
+        for _ in range(num_comm_intervals - len(flat_sub_partitions)):
+            flat_sub_partitions.append(
+                torch.zeros(int(sub_partition_size),
+                            dtype=dtype,
+                            device=device))
+    return flat_sub_partitions
+
+
+def _random_layout(rng):
+    world_size = rng.choice([1, 2, 4])
+    tensor_list = [
+        torch.empty(rng.randint(1,
+                                64),
+                    dtype=torch.half) for _ in range(rng.randint(1,
+                                                                 12))
+    ]
+    max_elements_per_comm = rng.randint(world_size, 256)
+
+    flat = flatten_dense_tensors_sub_partition_aligned(
+        tensor_list=tensor_list,
+        dp=world_size,
+        max_elements_per_comm=max_elements_per_comm,
+        pg=None)
+    comm_partitions, dp_sub_partitions, element_intervals, sub_partition_size, num_comm_intervals = \
+        FP16_DeepSpeedZeroOptimizer_Stage1.get_data_parallel_sub_partitions(
+            tensor=flat,
+            max_elements_per_comm=max_elements_per_comm,
+            world_size=world_size,
+            dp_process_group=None,
+            local_rank=1)
+
+    return world_size, tensor_list, element_intervals, sub_partition_size, num_comm_intervals
+
+
+def test_group_alignment_padding_matches_reference():
+    rng = random.Random(1234)
+    for _ in range(200):
+        tensor_list = [
+            torch.empty(rng.randint(1,
+                                    64)) for _ in range(rng.randint(1,
+                                                                    12))
+        ]
+        sub_partition_size = rng.randint(1, 128)
+        sub_partition_count = rng.randint(1, 16)
+        assert get_group_alignment_padding(tensor_list,
+                                           sub_partition_size,
+                                           sub_partition_count) == \
+            _ref_group_alignment_padding(tensor_list,
+                                         sub_partition_size,
+                                         sub_partition_count)
+
+
+def test_sub_partition_info_matches_reference():
+    rng = random.Random(1234)
+    for _ in range(50):
+        world_size, tensor_list, element_intervals, _, _ = _random_layout(rng)
+        local_rank = rng.randint(0, world_size - 1)
+
+        params, offsets, not_local = \
+            FP16_DeepSpeedZeroOptimizer_Stage1.get_all_sub_partition_info(
+                tensor_list=tensor_list,
+                all_element_intervals=element_intervals,
+                local_rank=local_rank,
+                world_size=world_size)
+        ref_params, ref_offsets, ref_not_local = _ref_get_all_sub_partition_info(
+            tensor_list,
+            element_intervals,
+            local_rank,
+            world_size)
+
+        assert len(params) == len(ref_params)
+        for rank_params, ref_rank_params in zip(params, ref_params):
+            assert len(rank_params) == len(ref_rank_params)
+            for comm_params, ref_comm_params in zip(rank_params, ref_rank_params):
+                assert len(comm_params) == len(ref_comm_params)
+                assert all(a is b for a,
+                           b in zip(comm_params,
+                                    ref_comm_params))
+        # offsets are packed into int64 tensors; the reference keeps ints
+        for rank_offsets, ref_rank_offsets in zip(offsets, ref_offsets):
+            assert [[int(x) for x in comm_offsets]
+                    for comm_offsets in rank_offsets] == ref_rank_offsets
+        assert all(a is b for a, b in zip(not_local, ref_not_local))
+        assert len(not_local) == len(ref_not_local)
+
+
+def test_copy_plan_replay_matches_flatten():
+    rng = random.Random(1234)
+    for _ in range(50):
+        world_size, tensor_list, element_intervals, sub_partition_size, num_comm_intervals = \
+            _random_layout(rng)
+        for tensor in tensor_list:
+            # leave some grads unset; both paths must contribute zeros
+            tensor.grad = torch.randn_like(tensor) if rng.random() > 0.2 else None
+
+        params, offsets, _ = \
+            FP16_DeepSpeedZeroOptimizer_Stage1.get_all_sub_partition_info(
+                tensor_list=tensor_list,
+                all_element_intervals=element_intervals,
+                local_rank=0,
+                world_size=world_size)
+        plans = FP16_DeepSpeedZeroOptimizer_Stage1._build_sub_partition_copy_plans(
+            params,
+            offsets,
+            sub_partition_size=sub_partition_size,
+            num_comm_intervals=num_comm_intervals)
+
+        for rank in range(world_size):
+            flat_sub_partitions = \
+                FP16_DeepSpeedZeroOptimizer_Stage1.get_flat_sub_partitions(
+                    comm_tensor_list=params[rank],
+                    comm_param_offsets=offsets[rank],
+                    sub_partition_size=sub_partition_size,
+                    dtype=torch.float,
+                    default_device='cpu',
+                    num_comm_intervals=num_comm_intervals)
+            # reference last: it materializes zero grads for params whose
+            # grad is None, which the two paths above must not rely on
+            ref_sub_partitions = _ref_get_flat_sub_partitions(
+                comm_tensor_list=params[rank],
+                comm_param_offsets=offsets[rank],
+                sub_partition_size=sub_partition_size,
+                dtype=torch.float,
+                default_device='cpu',
+                num_comm_intervals=num_comm_intervals)
+            assert len(plans[rank]) == num_comm_intervals
+            assert len(flat_sub_partitions) == len(ref_sub_partitions)
+            for interval_plan, staged, expected in zip(plans[rank],
+                                                       flat_sub_partitions,
+                                                       ref_sub_partitions):
+                replayed = \
+                    FP16_DeepSpeedZeroOptimizer_Stage1._flatten_sub_partition_from_plan(
+                        interval_plan,
+                        torch.empty(int(sub_partition_size),
+                                    dtype=torch.float))
+                assert torch.equal(staged, expected)
+                assert torch.equal(replayed, expected)
+
+
+def _ref_retrieve_group_sub_partition_weights(self,
+                                              all_partition_fp32_weights,
+                                              max_elems_per_comm):
+    num_partitions = len(all_partition_fp32_weights)
+    num_comm_intervals = len(all_partition_fp32_weights[0])
+    num_sub_partitions = num_partitions * num_comm_intervals
+    all_sub_partition_weights = [None] * num_sub_partitions
+
+    for rank, partition_weights in enumerate(all_partition_fp32_weights):
+        for comm_idx, sub_partition_weights in enumerate(partition_weights):
+            sub_partition_idx = (comm_idx * num_partitions) + rank
+            all_sub_partition_weights[sub_partition_idx] = sub_partition_weights
+
+    flat_merged_weights = flatten_dense_tensors_sub_partition_aligned(
+        tensor_list=all_sub_partition_weights,
+        dp=self.partition_count,
+        max_elements_per_comm=max_elems_per_comm,
+        pg=self.dp_process_group)
+
+    comm_partitions, dp_sub_partitions, element_intervals, sub_partition_size, num_comm_intervals = \
+        FP16_DeepSpeedZeroOptimizer_Stage1.get_data_parallel_sub_partitions(
+            tensor=flat_merged_weights,
+            max_elements_per_comm=max_elems_per_comm,
+            world_size=self.partition_count,
+            dp_process_group=self.dp_process_group,
+            local_rank=self.local_rank)
+
+    return [sub_partition for sub_partition in dp_sub_partitions[self.local_rank]]
+
+
+def test_checkpoint_weight_interleave_matches_reference():
+    rng = random.Random(1234)
+    for _ in range(50):
+        world_size = rng.choice([1, 2, 4])
+        num_comm_intervals = rng.randint(1, 4)
+        sub_partition_size = rng.randint(1, 32)
+        all_partition_fp32_weights = [[
+            torch.randn(sub_partition_size) for _ in range(num_comm_intervals)
+        ] for _ in range(world_size)]
+        fake_self = types.SimpleNamespace(partition_count=world_size,
+                                          dp_process_group=None,
+                                          local_rank=rng.randint(0,
+                                                                 world_size - 1))
+
+        merged = FP16_DeepSpeedZeroOptimizer_Stage1._retrieve_group_sub_partition_weights(
+            fake_self,
+            all_partition_fp32_weights,
+            max_elems_per_comm=sub_partition_size * world_size)
+        ref_merged = _ref_retrieve_group_sub_partition_weights(
+            fake_self,
+            all_partition_fp32_weights,
+            max_elems_per_comm=sub_partition_size * world_size)
+
+        assert len(merged) == len(ref_merged)
+        for sub_partition, ref_sub_partition in zip(merged, ref_merged):
+            assert torch.equal(sub_partition, ref_sub_partition)